@@ -1,5 +1,15 @@
-import streamlit as st
 import os
+
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", os.cpu_count() or 4))
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_THREADS))
+
+import streamlit as st
+import torch
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from heapq import nlargest
+from importlib.util import find_spec
+from operator import itemgetter
 import pandas as pd
 from pinecone import Pinecone
 from pymongo import MongoClient
@@ -14,6 +24,22 @@ st.set_page_config(
 )
 
 
+def load_embedding_model():
+    # Query vectors come from the int8-quantized ONNX graph, while ingest_data.py
+    # still encodes documents with the fp32 PyTorch model, so the two encoders
+    # differ slightly; cosine scores are close but not bit-identical.
+    if find_spec("onnxruntime") and find_spec("optimum"):
+        try:
+            return SentenceTransformer(
+                "sentence-transformers/all-MiniLM-L6-v2",
+                backend="onnx",
+                model_kwargs={"file_name": "onnx/model_quint8_avx2.onnx"},
+            )
+        except Exception as e:
+            print(f"ONNX backend unavailable, falling back to PyTorch: {e}")
+    return SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+
+
 @st.cache_resource
 def init_connections():
     try:
@@ -22,15 +48,26 @@ def init_connections():
         mongo_client = MongoClient(os.getenv("MONGO_URI"))
         db = mongo_client["arxiv_db"]
         collection = db["papers"]
-        model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+        torch.set_num_threads(TORCH_THREADS)
+        try:
+            torch.set_num_interop_threads(2)
+        except RuntimeError:
+            pass
+        model = load_embedding_model()
         return index, collection, model
     except Exception as e:
         st.error(f"Connection error: {e}")
         st.stop()
 
 
+@st.cache_resource
+def get_query_executor():
+    return ThreadPoolExecutor(max_workers=8)
+
+
 load_dotenv()
 index, collection, model = init_connections()
+executor = get_query_executor()
 
 
 with st.sidebar:
@@ -61,56 +98,75 @@ search_input = st.text_input(
 )
 
 
-def perform_search(queries):
-    all_results = []
-    seen_ids = set()
-
-    for query in queries:
-        try:
-            query_vector = model.encode(query.strip()).tolist()
-            pinecone_results = index.query(
-                vector=query_vector, top_k=15, include_metadata=False
+@st.cache_data(ttl=60, show_spinner=False)
+def get_data_version():
+    try:
+        state = collection.database["ingest_state"].find_one({"_id": "papers"})
+    except Exception:
+        return None
+    return str(state["version"]) if state else None
+
+
+@st.cache_data(ttl=300, max_entries=512, show_spinner=False)
+def perform_search(queries, data_version=None):
+    query_vectors = model.encode(
+        [query.strip() for query in queries],
+        batch_size=32,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    ).tolist()
+
+    futures = [
+        executor.submit(
+            index.query, vector=query_vector, top_k=15, include_metadata=False
+        )
+        for query_vector in query_vectors
+    ]
+    id_to_score = {}
+    for future in as_completed(futures):
+        pinecone_results = future.result()
+        for res in pinecone_results.get("matches", []):
+            id_to_score[res["id"]] = max(
+                res["score"], id_to_score.get(res["id"], float("-inf"))
             )
 
-            result_ids = [res["id"] for res in pinecone_results.get("matches", [])]
-            id_to_score = {
-                res["id"]: res["score"] for res in pinecone_results.get("matches", [])
-            }
+    if not id_to_score:
+        return []
 
-            if not result_ids:
-                continue
-
-            papers_metadata = list(collection.find({"_id": {"$in": result_ids}}))
-
-            for meta in papers_metadata:
-                paper_id = meta["_id"]
-                if paper_id not in seen_ids:
-                    all_results.append(
-                        {
-                            "id": paper_id,
-                            "score": id_to_score.get(paper_id, 0),
-                            "title": meta.get("title", "No Title"),
-                            "summary": meta.get("summary", "No summary available."),
-                            "authors": meta.get("authors", "No authors listed"),
-                            "pdf_url": meta.get("pdf_url", "#"),
-                            "type": meta.get("type", "recent"),
-                        }
-                    )
-                    seen_ids.add(paper_id)
-        except Exception as e:
-            st.error(f"Error processing query '{query}': {e}")
+    all_results = []
+    papers_metadata = collection.find(
+        {"_id": {"$in": list(id_to_score)}},
+        {"title": 1, "summary": 1, "authors": 1, "pdf_url": 1, "type": 1},
+    )
+    for meta in papers_metadata:
+        paper_id = meta["_id"]
+        all_results.append(
+            {
+                "id": paper_id,
+                "score": id_to_score[paper_id],
+                "title": meta.get("title", "No Title"),
+                "summary": meta.get("summary", "No summary available."),
+                "authors": meta.get("authors", "No authors listed"),
+                "pdf_url": meta.get("pdf_url", "#"),
+                "type": meta.get("type", "recent"),
+            }
+        )
 
-    all_results.sort(key=lambda x: x["score"], reverse=True)
-    return all_results[:25]
+    return nlargest(25, all_results, key=itemgetter("score"))
 
 
 if st.button("🔍 Search", use_container_width=True, type="primary"):
     if search_input.strip():
-        queries = [q.strip() for q in search_input.split(";") if q.strip()]
-        with st.spinner("Searching across 30,000+ papers..."):
-            search_results = perform_search(queries)
-
-        st.session_state.search_results = search_results
+        queries = tuple(
+            sorted({q.lower().strip() for q in search_input.split(";") if q.strip()})
+        )
+        try:
+            with st.spinner("Searching across 30,000+ papers..."):
+                search_results = perform_search(queries, get_data_version())
+            st.session_state.search_results = search_results
+        except Exception as e:
+            st.error(f"Error processing search: {e}")
+            st.session_state.pop("search_results", None)
     else:
         st.warning("Please enter a search query.")
 
@@ -132,9 +188,7 @@ if "search_results" in st.session_state and st.session_state.search_results:
     filtered_results = [r for r in results if r["type"].capitalize() in filter_options]
 
     if sort_option == "Title":
-        filtered_results.sort(key=lambda x: x["title"])
-    else:
-        filtered_results.sort(key=lambda x: x["score"], reverse=True)
+        filtered_results.sort(key=itemgetter("title"))
 
     if not filtered_results:
         st.info("No results match your filter criteria. Try adjusting the filters.")
@@ -1,31 +1,64 @@
 import os
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import arxiv
+import numpy as np
 from pinecone import Pinecone
 from pymongo import MongoClient, operations
+from pymongo.errors import OperationFailure
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 from tqdm import tqdm
 from datetime import datetime, timezone, timedelta
 import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 MAX_ITEMS = 30000
 RECENT_ITEMS = 27000
 CLASSIC_ITEMS = 3000
-BATCH_SIZE = 200
+EMBED_BATCH_SIZE = 64
+ENCODE_BUFFER_SIZE = 256
+WRITE_BATCH_SIZE = 500
+PINECONE_UPSERT_BATCH_SIZE = 200
+ARXIV_ID_BATCH_SIZE = 100
+QUEUE_DEPTH = 4
+WRITE_WORKERS = 2
 
 CATEGORIES = (
     "cat:cs.AI OR cat:cs.LG OR cat:cs.CL OR cat:cs.CV "
     "OR cat:stat.ML OR cat:cs.IR OR cat:cs.NE OR cat:cs.RO"
 )
 
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504]
+        ),
+    ),
+)
+
+_NL_TABLE = str.maketrans({"\n": " ", "\r": " ", "\t": " "})
+
+ARXIV_VERSION_SUFFIX = re.compile(r"v\d+$")
+
+ARXIV_URL_PATTERN = re.compile(
+    r"https://arxiv.org/(?:abs|pdf)/(\d{4}\.\d{4,5}(?:v\d+)?)"
+)
+
 
 def cleanup_old_items(collection, index, max_items=MAX_ITEMS):
     current_count = collection.count_documents({})
     if current_count > max_items:
         docs_to_delete = list(
-            collection.find({"type": {"$ne": "classic"}})
+            collection.find({"type": {"$in": ["recent", None]}})
             .sort("ingested_at", 1)
             .limit(current_count - max_items)
         )
@@ -46,6 +79,27 @@ def cleanup_old_items(collection, index, max_items=MAX_ITEMS):
             print("No old non-classic papers to delete.")
 
 
+def load_processed_ids(collection):
+    try:
+        return set(collection.distinct("_id"))
+    except OperationFailure:
+        return set(doc["_id"] for doc in collection.find({}, {"_id": 1}))
+
+
+def strip_arxiv_version(arxiv_id):
+    return ARXIV_VERSION_SUFFIX.sub("", arxiv_id)
+
+
+def fetch_awesome_list(url):
+    try:
+        response = SESSION.get(url, timeout=10)
+        response.raise_for_status()
+        return response.text
+    except requests.RequestException as e:
+        print(f"\nCould not fetch {url}: {e}")
+        return ""
+
+
 def fetch_classic_ids_from_github(n):
     awesome_lists = [
         "https://raw.githubusercontent.com/terryum/awesome-deep-learning-papers/master/README.md",
@@ -55,22 +109,21 @@ def fetch_classic_ids_from_github(n):
         "https://raw.githubusercontent.com/jtoy/awesome-tensorflow/master/README.md",
         "https://raw.githubusercontent.com/kjw0612/awesome-deep-vision/master/README.md",
     ]
-    arxiv_pattern = re.compile(
-        r"https://arxiv.org/(?:abs|pdf)/(\d{4}\.\d{4,5}(?:v\d+)?)"
-    )
     classic_ids = set()
     print("Fetching classic paper IDs from GitHub 'Awesome' lists...")
-    for url in tqdm(awesome_lists, desc="Scanning Awesome Lists"):
-        try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            text = response.text
-            found_ids = arxiv_pattern.findall(text)
-            classic_ids.update(found_ids)
-        except requests.RequestException as e:
-            print(f"\nCould not fetch {url}: {e}")
+    with ThreadPoolExecutor(max_workers=len(awesome_lists)) as executor:
+        texts = executor.map(fetch_awesome_list, awesome_lists)
+        for text in tqdm(
+            texts, total=len(awesome_lists), desc="Scanning Awesome Lists"
+        ):
+            for match in ARXIV_URL_PATTERN.finditer(text):
+                classic_ids.add(match.group(1))
+                if len(classic_ids) >= n:
+                    break
+            if len(classic_ids) >= n:
+                break
     print(f"Found {len(classic_ids)} unique IDs from GitHub.")
-    return list(classic_ids)[:n]
+    return list(classic_ids)
 
 
 def fetch_classic_ids_from_semantic_scholar(n):
@@ -91,7 +144,7 @@ def fetch_classic_ids_from_semantic_scholar(n):
             data = {}
             while retries < max_retries:
                 try:
-                    resp = requests.get(url)
+                    resp = SESSION.get(url)
                     if resp.status_code == 429:
                         print("Rate limit hit, sleeping for 60 seconds...")
                         time.sleep(60)
@@ -125,53 +178,211 @@ def fetch_classic_ids_from_semantic_scholar(n):
     return list(classic_ids)
 
 
-def fetch_arxiv_metadata(arxiv_id):
+def fetch_arxiv_metadata(client, arxiv_ids):
+    papers = []
+    try:
+        search = arxiv.Search(id_list=arxiv_ids, max_results=len(arxiv_ids))
+        for paper in client.results(search):
+            clean_id = paper.entry_id.split("/")[-1]
+            papers.append(
+                {
+                    "_id": clean_id,
+                    "title": paper.title,
+                    "summary": paper.summary,
+                    "authors": ", ".join([a.name for a in paper.authors]),
+                    "pdf_url": paper.pdf_url,
+                }
+            )
+    except arxiv.HTTPError as e:
+        if e.status != 400 or len(arxiv_ids) == 1:
+            print(f"\nError fetching metadata for {len(arxiv_ids)} IDs: {e}")
+            return []
+        mid = len(arxiv_ids) // 2
+        return fetch_arxiv_metadata(client, arxiv_ids[:mid]) + fetch_arxiv_metadata(
+            client, arxiv_ids[mid:]
+        )
+    except Exception as e:
+        print(f"\nError fetching metadata for {len(arxiv_ids)} IDs: {e}")
+        return []
+    return papers
+
+
+def wait_for_writes(max_pending=0):
+    while len(pending_writes) > max_pending:
+        future = pending_writes.pop(0)
+        try:
+            future.result()
+        except Exception as e:
+            print(f"\nFailed to write batch: {e}")
+
+
+def write_batch(collection, index, vectors_batch, mongo_batch):
+    index.upsert(
+        vectors=vectors_batch,
+        batch_size=PINECONE_UPSERT_BATCH_SIZE,
+        show_progress=False,
+    )
+    collection.bulk_write(mongo_batch, ordered=False, bypass_document_validation=True)
+
+
+def flush_batches(collection, index, vectors_batch, mongo_batch):
+    wait_for_writes(WRITE_WORKERS - 1)
+    pending_writes.append(
+        write_pool.submit(write_batch, collection, index, vectors_batch, mongo_batch)
+    )
+
+
+def quantize_embeddings(embeddings):
+    scale = 127 / np.maximum(np.abs(embeddings).max(axis=1, keepdims=True), 1e-12)
+    return np.rint(embeddings * scale).astype(np.int8)
+
+
+def encode_texts(texts):
+    return model.encode(
+        texts,
+        batch_size=EMBED_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+
+
+def encode_batch(pending):
+    try:
+        embeddings = encode_texts([text for _, _, text in pending])
+    except Exception as e:
+        print(
+            f"\nFailed to encode batch of {len(pending)} papers, "
+            f"retrying one at a time: {e}"
+        )
+        encoded = []
+        for item in pending:
+            try:
+                encoded.append((item, encode_texts([item[2]])[0]))
+            except Exception as e:
+                print(f"\nFailed to encode paper {item[0]}: {e}")
+        if not encoded:
+            return [], []
+        pending = [item for item, _ in encoded]
+        embeddings = np.stack([embedding for _, embedding in encoded])
+    quantized = quantize_embeddings(embeddings).astype(np.float32).tolist()
+    vectors, mongo_ops = [], []
+    for (doc_id, fields, _), values in zip(pending, quantized):
+        vectors.append((doc_id, values))
+        mongo_ops.append(
+            operations.UpdateOne({"_id": doc_id}, {"$set": fields}, upsert=True)
+        )
+    return vectors, mongo_ops
+
+
+def encode_worker(fetch_q, flush_q, errors):
+    pending = []
+    item = ()
+    try:
+        while True:
+            item = fetch_q.get()
+            if item is not None:
+                pending.append(item)
+            if pending and (item is None or len(pending) >= ENCODE_BUFFER_SIZE):
+                flush_q.put(encode_batch(pending))
+                pending = []
+            if item is None:
+                break
+    except Exception as e:
+        errors.append(e)
+        while item is not None:
+            item = fetch_q.get()
+    flush_q.put(None)
+
+
+def write_worker(collection, index, flush_q, errors):
+    vectors_batch, mongo_batch = [], []
+    item = ()
     try:
-        search = arxiv.Search(id_list=[arxiv_id])
-        paper = next(arxiv.Client().results(search))
-        clean_id = paper.entry_id.split("/")[-1]
-        return {
-            "_id": clean_id,
-            "title": paper.title,
-            "summary": paper.summary,
-            "authors": ", ".join([a.name for a in paper.authors]),
-            "pdf_url": paper.pdf_url,
-        }
+        while True:
+            item = flush_q.get()
+            if item is None:
+                break
+            vectors, mongo_ops = item
+            vectors_batch.extend(vectors)
+            mongo_batch.extend(mongo_ops)
+            if len(vectors_batch) >= WRITE_BATCH_SIZE:
+                flush_batches(collection, index, vectors_batch, mongo_batch)
+                vectors_batch, mongo_batch = [], []
+        if vectors_batch:
+            flush_batches(collection, index, vectors_batch, mongo_batch)
+        wait_for_writes()
     except Exception as e:
-        print(f"\nError fetching metadata for {arxiv_id}: {e}")
-        return None
+        errors.append(e)
+        while item is not None:
+            item = flush_q.get()
 
 
-def ingest_classic_papers(collection, index, processed_ids, limit=CLASSIC_ITEMS):
+def start_ingest_pipeline(collection, index):
+    fetch_q = queue.Queue(maxsize=EMBED_BATCH_SIZE * QUEUE_DEPTH)
+    flush_q = queue.Queue(maxsize=QUEUE_DEPTH)
+    errors = []
+    workers = [
+        threading.Thread(
+            target=encode_worker, args=(fetch_q, flush_q, errors), daemon=True
+        ),
+        threading.Thread(
+            target=write_worker,
+            args=(collection, index, flush_q, errors),
+            daemon=True,
+        ),
+    ]
+    for worker in workers:
+        worker.start()
+    return fetch_q, workers, errors
+
+
+def stop_ingest_pipeline(fetch_q, workers, errors):
+    fetch_q.put(None)
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+
+
+def ingest_classic_papers(collection, index, limit=CLASSIC_ITEMS):
     print("Starting hybrid ingestion of classic papers...")
     github_ids = fetch_classic_ids_from_github(limit)
     scholar_ids = fetch_classic_ids_from_semantic_scholar(limit // 2)
-    combined_ids = set(github_ids) | set(scholar_ids)
+    combined_ids = {
+        strip_arxiv_version(cid) for cid in set(github_ids) | set(scholar_ids)
+    }
     print(f"Found a combined total of {len(combined_ids)} unique classic paper IDs.")
     classic_ids_to_fetch = list(combined_ids)
-    new_classic_ids = [cid for cid in classic_ids_to_fetch if cid not in processed_ids]
+    id_patterns = [
+        re.compile(rf"^{re.escape(cid)}(?:v\d+)?$") for cid in classic_ids_to_fetch
+    ]
+    existing_ids = {
+        strip_arxiv_version(doc_id)
+        for doc_id in collection.distinct("_id", {"_id": {"$in": id_patterns}})
+    }
+    new_classic_ids = [cid for cid in classic_ids_to_fetch if cid not in existing_ids]
     if not new_classic_ids:
         print("No new classic papers to ingest.")
-        return processed_ids
+        return
     print(f"Ingesting {len(new_classic_ids)} new classic papers...")
     classic_ingested = 0
-    vectors_batch, mongo_batch = [], []
-    for arxiv_id in tqdm(new_classic_ids, desc="Ingesting classic papers"):
-        meta = fetch_arxiv_metadata(arxiv_id)
-        if not meta:
-            continue
-        try:
-            title = meta.get("title", "")
-            summary = meta.get("summary", "")
-            cleaned_summary = summary.replace("\n", " ")
-            text_to_embed = f"Title: {title}. Abstract: {cleaned_summary}"
-            embedding = model.encode(text_to_embed).tolist()
-            doc_id = meta["_id"]
-            vectors_batch.append((doc_id, embedding))
-            mongo_op = operations.UpdateOne(
-                {"_id": doc_id},
-                {
-                    "$set": {
+    client = arxiv.Client(page_size=ARXIV_ID_BATCH_SIZE, delay_seconds=3, num_retries=5)
+    fetch_q, workers, errors = start_ingest_pipeline(collection, index)
+    try:
+        for i in tqdm(
+            range(0, len(new_classic_ids), ARXIV_ID_BATCH_SIZE),
+            desc="Ingesting classic paper batches",
+        ):
+            id_batch = new_classic_ids[i : i + ARXIV_ID_BATCH_SIZE]
+            for meta in fetch_arxiv_metadata(client, id_batch):
+                try:
+                    title = meta.get("title", "")
+                    summary = meta.get("summary", "")
+                    cleaned_summary = summary.translate(_NL_TABLE)
+                    text_to_embed = f"Title: {title}. Abstract: {cleaned_summary}"
+                    doc_id = meta["_id"]
+                    fields = {
                         "title": title,
                         "summary": cleaned_summary,
                         "authors": meta.get("authors", ""),
@@ -179,25 +390,15 @@ def ingest_classic_papers(collection, index, processed_ids, limit=CLASSIC_ITEMS)
                         "ingested_at": datetime.now(timezone.utc),
                         "type": "classic",
                     }
-                },
-                upsert=True,
-            )
-            mongo_batch.append(mongo_op)
-            classic_ingested += 1
-            processed_ids.add(doc_id)
-            if len(vectors_batch) >= BATCH_SIZE:
-                index.upsert(vectors=vectors_batch)
-                collection.bulk_write(mongo_batch)
-                vectors_batch, mongo_batch = [], []
-        except Exception as e:
-            print(f"\nFailed to process classic paper {arxiv_id}: {e}")
-    if vectors_batch:
-        index.upsert(vectors=vectors_batch)
-        collection.bulk_write(mongo_batch)
+                    fetch_q.put((doc_id, fields, text_to_embed))
+                    classic_ingested += 1
+                except Exception as e:
+                    print(f"\nFailed to process classic paper {meta.get('_id')}: {e}")
+    finally:
+        stop_ingest_pipeline(fetch_q, workers, errors)
     print(
         f"Classic papers ingestion complete! Processed {classic_ingested} new papers."
     )
-    return processed_ids
 
 
 print("Initializing connections and models...")
@@ -208,95 +409,89 @@ index = pc.Index("arxiv-search")
 mongo_client = MongoClient(os.getenv("MONGO_URI"))
 db = mongo_client["arxiv_db"]
 collection = db["papers"]
-print("Ensuring database index exists for 'ingested_at'...")
+write_pool = ThreadPoolExecutor(max_workers=WRITE_WORKERS)
+pending_writes = []
+print("Ensuring database indexes exist for 'ingested_at' and 'type'...")
 collection.create_index([("ingested_at", 1)])
+collection.create_index([("type", 1), ("ingested_at", 1)])
 print("Initialization complete.")
 print("-" * 50)
 
 cleanup_old_items(collection, index, MAX_ITEMS)
-processed_ids = set(doc["_id"] for doc in collection.find({}, {"_id": 1}))
-
-processed_ids = ingest_classic_papers(collection, index, processed_ids, CLASSIC_ITEMS)
+ingest_classic_papers(collection, index, CLASSIC_ITEMS)
 print("-" * 50)
 
+processed_ids = load_processed_ids(collection)
+
 client = arxiv.Client(page_size=500, delay_seconds=5, num_retries=5)
-vectors_batch = []
-mongo_batch = []
+fetch_q, workers, errors = start_ingest_pipeline(collection, index)
 papers_ingested_count = 0
 weeks_to_go_back = 0
 print("Starting nightly ingestion of recent papers...")
-with tqdm(total=RECENT_ITEMS, desc="Ingesting recent papers") as pbar:
-    while papers_ingested_count < RECENT_ITEMS:
-        end_date = datetime.now(timezone.utc) - timedelta(weeks=weeks_to_go_back)
-        start_date = end_date - timedelta(days=7)
-        start_date_str = start_date.strftime("%Y%m%d")
-        end_date_str = end_date.strftime("%Y%m%d")
-        print(f"\nFetching papers from {start_date_str} to {end_date_str}...")
-        query_for_week = (
-            f"({CATEGORIES}) AND submittedDate:[{start_date_str} TO {end_date_str}]"
-        )
-        search = arxiv.Search(
-            query=query_for_week,
-            max_results=5000,
-            sort_by=arxiv.SortCriterion.SubmittedDate,
-            sort_order=arxiv.SortOrder.Descending,
-        )
-        try:
-            results = client.results(search)
-            found_in_chunk = 0
-            for paper in results:
-                doc_id = paper.entry_id.split("/")[-1]
-                if doc_id in processed_ids:
-                    continue
-                title = paper.title or ""
-                summary = paper.summary or ""
-                cleaned_summary = summary.replace("\n", " ")
-                text_to_embed = f"Title: {title}. Abstract: {cleaned_summary}"
-                embedding = model.encode(text_to_embed).tolist()
-                vectors_batch.append((doc_id, embedding))
-                mongo_op = operations.UpdateOne(
-                    {"_id": doc_id},
-                    {
-                        "$set": {
-                            "title": title,
-                            "summary": cleaned_summary,
-                            "authors": ", ".join([a.name for a in paper.authors]),
-                            "pdf_url": paper.pdf_url,
-                            "ingested_at": datetime.now(timezone.utc),
-                            "type": "recent",
-                        }
-                    },
-                    upsert=True,
-                )
-                mongo_batch.append(mongo_op)
-                processed_ids.add(doc_id)
-                papers_ingested_count += 1
-                found_in_chunk += 1
-                pbar.update(1)
-                if len(vectors_batch) >= BATCH_SIZE:
-                    index.upsert(vectors=vectors_batch)
-                    collection.bulk_write(mongo_batch)
-                    vectors_batch, mongo_batch = [], []
-                if papers_ingested_count >= RECENT_ITEMS:
-                    break
-            if found_in_chunk == 0:
-                print("Found no new papers in this period. Searching further back.")
-        except Exception as e:
-            print(
-                f"\nCould not process results for week {start_date_str}-{end_date_str}: {e}"
+try:
+    with tqdm(total=RECENT_ITEMS, desc="Ingesting recent papers") as pbar:
+        while papers_ingested_count < RECENT_ITEMS:
+            end_date = datetime.now(timezone.utc) - timedelta(weeks=weeks_to_go_back)
+            start_date = end_date - timedelta(days=7)
+            start_date_str = start_date.strftime("%Y%m%d")
+            end_date_str = end_date.strftime("%Y%m%d")
+            print(f"\nFetching papers from {start_date_str} to {end_date_str}...")
+            query_for_week = (
+                f"({CATEGORIES}) AND submittedDate:[{start_date_str} TO {end_date_str}]"
             )
-        weeks_to_go_back += 1
-        if weeks_to_go_back > 156:
-            print("\nSearched 3 years back, stopping.")
-            break
-if vectors_batch:
-    index.upsert(vectors=vectors_batch)
-    collection.bulk_write(mongo_batch)
+            search = arxiv.Search(
+                query=query_for_week,
+                max_results=5000,
+                sort_by=arxiv.SortCriterion.SubmittedDate,
+                sort_order=arxiv.SortOrder.Descending,
+            )
+            try:
+                results = client.results(search)
+                found_in_chunk = 0
+                for paper in results:
+                    doc_id = paper.entry_id.split("/")[-1]
+                    if doc_id in processed_ids:
+                        continue
+                    title = paper.title or ""
+                    summary = paper.summary or ""
+                    cleaned_summary = summary.translate(_NL_TABLE)
+                    text_to_embed = f"Title: {title}. Abstract: {cleaned_summary}"
+                    fields = {
+                        "title": title,
+                        "summary": cleaned_summary,
+                        "authors": ", ".join([a.name for a in paper.authors]),
+                        "pdf_url": paper.pdf_url,
+                        "ingested_at": datetime.now(timezone.utc),
+                        "type": "recent",
+                    }
+                    fetch_q.put((doc_id, fields, text_to_embed))
+                    processed_ids.add(doc_id)
+                    papers_ingested_count += 1
+                    found_in_chunk += 1
+                    pbar.update(1)
+                    if papers_ingested_count >= RECENT_ITEMS:
+                        break
+                if found_in_chunk == 0:
+                    print("Found no new papers in this period. Searching further back.")
+            except Exception as e:
+                print(
+                    f"\nCould not process results for week {start_date_str}-{end_date_str}: {e}"
+                )
+            weeks_to_go_back += 1
+            if weeks_to_go_back > 156:
+                print("\nSearched 3 years back, stopping.")
+                break
+finally:
+    stop_ingest_pipeline(fetch_q, workers, errors)
 print(f"\nRecent papers ingestion complete! Processed {papers_ingested_count} papers.")
 print("-" * 50)
 
 cleanup_old_items(collection, index, MAX_ITEMS)
+db["ingest_state"].update_one(
+    {"_id": "papers"}, {"$set": {"version": datetime.now(timezone.utc)}}, upsert=True
+)
 print(
     f"\nData ingestion complete! Total papers in DB: {collection.count_documents({})}"
 )
+write_pool.shutdown()
 mongo_client.close()